@@ -7,54 +7,143 @@ Sistema de Projetos - Streamlit (Versão com Cálculos de Card Ajustados)
 import streamlit as st
 import pandas as pd
 from pymongo import MongoClient
+from pymongo.errors import DuplicateKeyError, OperationFailure
 from datetime import datetime
-import plotly.express as px
-from PIL import Image
 import io
+import re
 import hashlib  ## NOVO ## - Biblioteca para criptografar a senha
+import hmac
+
+# Campos lidos do MongoDB: só o que o app grava e exibe (o _id fica de fora já na consulta)
+PROJECAO_DASHBOARD = {"_id": 0, "ID_Projeto": 1, "Id_Contrato": 1, "Requisicao": 1, "Area_Setor": 1, "Categoria": 1, "Empresa": 1, "Responsavel": 1, "Atividades_Descricao": 1, "Link_dos_Arquivos": 1, "Status": 1, "Tem_Budget": 1, "Tem_Baseline": 1, "Budget": 1, "Baseline": 1, "Melhor_Proposta": 1, "Preco_Inicial": 1, "Preco_Final": 1, "Saving_R$": 1, "Percent_Saving": 1, "CE_Baseline_R$": 1, "Percent_CE_Baseline": 1, "CE_R$": 1, "Percent_CE": 1, "Dias": 1, "Progresso_Percent": 1, "Data_Inicio": 1, "Data_Termino": 1}
+
+# Listas fixas de status e empresas: tuplas criadas uma vez na importação, e não a cada rerun do Streamlit.
+# Os dicionários *_INDEX dão a posição de cada opção nos selectbox em O(1).
+STATUS_OPTIONS = ("Á Iniciar","Em andamento","Atrasado","Concluído","Stand By","Cancelado")
+STATUS_INDEX = {status: i for i, status in enumerate(STATUS_OPTIONS)}
+EMPRESAS_OPTIONS = ("Postos Gulf","Alpha Matrix","Am Gestao Filz","Am Gestao Mtz","Bcag Sp 0002","Carneiros Go","Carinthia Rj 01","Carinthia Rj 03","Churchill","Clio","Direcional Es","Direcional Fil","Direcional Mt","Direcional Sp","Estrela","Fatro","Fair Energy","Fera Rj","Fera Sp","Fit Marine","Fit Marine Filial","Fit Marine Matriz","Fitfiber","Flagler Go","Flagler Rj","Flagler Sp","Gooil Hub","Gooil","Logfit Filial Aruja","Logfit Filial Caxias","Logfit Filial Rj","Logfit Rj 0002","Logfit Rj 0004","Logfit Sp 0001","Logfit Sp 0006","Logfit Tms Filial","Magro Adv Fil","Magro Adv Matriz","Manguinhos Fil","Manguinhos Filial","Manguinhos Matriz","Manguinhos Mtz","Maximus To","Ornes Gestao","Paradise Td 0001","Petro Go 0006","Petro Rj 0006","Petro Rj 0007","Petro To 0001","Petro To 0004","Port Brazil","Refit Filial Alagoas","Refit Filial Amapa","Refit Matriz","Renomeada 57","Renomeada 61","Renomeada 62","Renomeada 65","Renomeada 66","Roar Fl 0003","Roar Rj 0004","Roar Matriz","Rodopetro Cn","Rodopetro Mtz","Rodopetro Rj Dc","Tiger Matriz","Tig","Uma Cidadania","Valsinha","Vascam","Xyz Sp","Yield Filial","Yield Matriz")
+EMPRESAS_INDEX = {empresa: i for i, empresa in enumerate(EMPRESAS_OPTIONS)}
+
+# Número de um ID "PROJ<n>" calculado pelo próprio MongoDB (null se o sufixo não for numérico)
+NUMERO_ID_PROJETO = {"$convert": {"input": {"$substrCP": ["$ID_Projeto", 4, {"$subtract": [{"$strLenCP": "$ID_Projeto"}, 4]}]}, "to": "int", "onError": None, "onNull": None}}
+
+COLUNAS_NUMERICAS = ('Budget','Baseline','Melhor_Proposta','Preco_Inicial','Preco_Final','Saving_R$','Percent_Saving','CE_Baseline_R$','Percent_CE_Baseline','CE_R$','Percent_CE','Dias','Progresso_Percent')
+COLUNAS_DATA = ('Data_Inicio','Data_Termino')
+
+def estagio_projecao(projection):
+    """Converte a projeção em um estágio $project que já entrega números e datas convertidos pelo MongoDB."""
+    estagio = {}
+    for campo, incluir in projection.items():
+        if not incluir or campo == "_id":
+            estagio[campo] = incluir
+        elif campo in COLUNAS_NUMERICAS:
+            # Mesmo efeito do antigo pd.to_numeric(errors='coerce').fillna(0), feito no servidor
+            estagio[campo] = {"$convert": {"input": f"${campo}", "to": "double", "onError": 0.0, "onNull": 0.0}}
+        elif campo in COLUNAS_DATA:
+            # O $convert só entende os formatos do $dateFromString (ISO etc.). Texto em outro formato (ex.: "15/01/2024",
+            # comum em registros antigos) volta como está e é interpretado pelo pd.to_datetime no carregar_dados.
+            estagio[campo] = {"$convert": {"input": f"${campo}", "to": "date", "onError": f"${campo}", "onNull": None}}
+        elif campo == "Link_dos_Arquivos":
+            estagio[campo] = {"$ifNull": [f"${campo}", ""]}
+        else:
+            estagio[campo] = 1
+    return {"$project": estagio}
 
 # =======================
 # FUNÇÕES AUXILIARES E DE LOGIN ## AJUSTE ##
 # =======================
 
 ## NOVO ## - Função para verificar as credenciais
+def _usuarios_por_nome():
+    """Indexa os usuários do secrets.toml pelo username. Sem cache: o st.secrets já está em memória, e um usuário
+    removido ou com senha trocada no secrets.toml vale na hora, sem reiniciar o servidor."""
+    users = st.secrets["usuarios"]
+    return {users[user_key]["username"]: users[user_key] for user_key in users}
+
+def _verificar_sha256(hash_armazenado, password):
+    """Senhas ainda em SHA-256 (hex) no secrets.toml. Sem cache: usuário removido ou senha trocada vale na hora."""
+    # Criptografa a senha digitada para comparar com a senha armazenada
+    hashed_password = hashlib.sha256(password.encode()).hexdigest()
+    # Comparação em tempo constante: o tempo de resposta não revela quantos caracteres do hash coincidem
+    return hmac.compare_digest(hashed_password, hash_armazenado) # Senha correta ou incorreta
+
+# Parâmetros do Argon2id para as senhas migradas: gere o hash com PasswordHasher(**ARGON2_PARAMETROS).hash(senha)
+ARGON2_PARAMETROS = {"time_cost": 2, "memory_cost": 19456, "parallelism": 1}
+
+def _verificar_argon2(hash_armazenado, password):
+    """Senhas já migradas para Argon2id ($argon2id$...): sal e custos vêm do próprio hash. Não é cacheada (precisaria da senha como chave)."""
+    from argon2 import PasswordHasher
+    from argon2.exceptions import InvalidHashError, VerificationError
+    try:
+        return PasswordHasher().verify(hash_armazenado, password)
+    except (VerificationError, InvalidHashError):
+        return False
+
+@st.cache_resource
+def _hash_argon2_ficticio():
+    """Hash Argon2 descartável, com os mesmos ARGON2_PARAMETROS das senhas migradas, para igualar o tempo de resposta do login."""
+    from argon2 import PasswordHasher
+    return PasswordHasher(**ARGON2_PARAMETROS).hash("senha-ficticia")
+
 def check_credentials(username, password):
     """Verifica se o usuário e a senha correspondem aos dados em secrets.toml."""
     try:
-        # Pega a lista de usuários do arquivo de segredos
-        users = st.secrets["usuarios"]
-        
-        # Procura pelo usuário na lista
-        for user_key in users:
-            user_data = users[user_key]
-            if user_data["username"] == username:
-                # Criptografa a senha digitada para comparar com a senha armazenada
-                hashed_password = hashlib.sha256(password.encode()).hexdigest()
-                if hashed_password == user_data["password"]:
-                    return True # Credenciais corretas
-        return False # Usuário não encontrado ou senha incorreta
+        user_data = _usuarios_por_nome().get(username)
+        hash_armazenado = str(user_data["password"]) if user_data is not None else ""
+        if hash_armazenado.startswith("$argon2"):
+            return _verificar_argon2(hash_armazenado, password)
+        # Usuário inexistente ou ainda em SHA-256: uma verificação Argon2 descartável deixa o tempo de resposta igual
+        # ao dos usuários migrados, para que ele não revele quais usernames existem ou já usam Argon2
+        _verificar_argon2(_hash_argon2_ficticio(), password)
+        if user_data is None:
+            return False # Usuário não encontrado
+        return _verificar_sha256(hash_armazenado, password)
     except Exception as e:
         st.error(f"Erro ao verificar credenciais: {e}")
         return False
 
+# Troca "," por "." e vice-versa num único passe (padrão brasileiro de milhar/decimal)
+_TABELA_BR = str.maketrans({",": ".", ".": ","})
+
 def formatar_moeda(valor):
     if pd.isna(valor) or valor is None:
         return "R$ 0,00"
     valor_float = float(valor)
-    return f"R$ {valor_float:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
+    return f"R$ {valor_float:,.2f}".translate(_TABELA_BR)
 
 def formatar_percentual(valor):
     if pd.isna(valor) or valor is None:
         return "0,00%"
     valor_float = float(valor)
-    return f"{valor_float:.2f}%".replace(".", ",")
-
-def convert_df_to_excel(df):
+    return f"{valor_float:.2f}%".translate(_TABELA_BR)
+
+@st.cache_data(ttl=600, show_spinner=False, max_entries=8)
+def convert_df_to_excel(chave, _df):
+    """Gera o .xlsx de _df. O cache usa só a chave (consulta, versão e instante da carga que gerou _df), então o
+    DataFrame não é hasheado a cada rerun e o arquivo nunca fica de uma carga diferente da tabela exibida."""
+    df = _df
+    # Workbook em modo write_only: as linhas vão direto para o arquivo, sem montar a grade de células na memória
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Alignment, Border, Font, Side
     output = io.BytesIO()
-    for col in df.select_dtypes(include=['datetimetz']).columns:
-        df[col] = df[col].dt.tz_localize(None)
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df.to_excel(writer, index=False, sheet_name='Dados')
+    # assign devolve um novo DataFrame: o fuso é removido sem alterar o DataFrame de quem chamou
+    df = df.assign(**{col: df[col].dt.tz_localize(None) for col in df.select_dtypes(include=['datetimetz']).columns})
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet('Dados')
+    # Cabeçalho com o mesmo estilo que o df.to_excel aplicava (negrito, borda fina, centralizado)
+    borda = Side(style="thin")
+    cabecalho = []
+    for col in df.columns:
+        celula = WriteOnlyCell(ws, value=str(col))
+        celula.font = Font(bold=True)
+        celula.border = Border(left=borda, right=borda, top=borda, bottom=borda)
+        celula.alignment = Alignment(horizontal="center", vertical="top")
+        cabecalho.append(celula)
+    ws.append(cabecalho)
+    for linha in df.astype(object).where(df.notna(), None).itertuples(index=False, name=None):
+        ws.append(linha)
+    wb.save(output)
     return output.getvalue()
 
 def calcular_kpis_financeiros(tem_budget, tem_baseline, budget, baseline, melhor_proposta, preco_inicial, preco_final):
@@ -76,6 +165,114 @@ def format_valor_kpi(valor):
     if valor >= 1_000: return f"R$ {valor/1_000:.2f}K"
     return formatar_moeda(valor)
 
+# Gráficos do Dashboard: cacheados pelos dados de entrada (já agregados), então reruns sem mudança de filtro
+# não reconstroem as figuras do Plotly. Plotly só é importado quando algum gráfico é montado.
+@st.cache_data(show_spinner=False)
+def montar_grafico_status(df_status):
+    import plotly.express as px
+    paleta = ['#F2C94C', '#2B9348', '#3596B5', '#9BAEBC', '#E74C3C', '#5D6D7E']
+    fig_status = px.bar(df_status, x='Status', y='Quantidade', color='Status', color_discrete_sequence=paleta, text_auto=True, title='Quantidade de Projetos por Status')
+    fig_status.update_traces(textposition='outside')
+    max_val = df_status['Quantidade'].max()
+    fig_status.update_yaxes(tickmode='linear', dtick=1, range=[0, max_val * 1.15])
+    return fig_status
+
+@st.cache_data(show_spinner=False)
+def montar_grafico_responsavel(resp_counts):
+    import plotly.express as px
+    fig_resp = px.bar(resp_counts, x='Responsavel', y='Quantidade', color='Quantidade', color_continuous_scale='Blues', text_auto=True, title='Quantidade de Projetos por Responsável')
+    fig_resp.update_traces(textposition='outside')
+    max_val = resp_counts['Quantidade'].max()
+    fig_resp.update_yaxes(tickmode='linear', dtick=1, range=[0, max_val * 1.15])
+    return fig_resp
+
+@st.cache_data(show_spinner=False)
+def montar_grafico_gantt(df_gantt):
+    """Recebe só as colunas do cronograma; filtra as linhas com as duas datas e ordena dentro do cache. None se não sobrar nenhuma."""
+    import plotly.express as px
+    # Uma única máscara booleana e um único recorte antes da ordenação, sem .copy() extra
+    df_gantt = df_gantt[df_gantt['Data_Inicio'].notna() & df_gantt['Data_Termino'].notna()]
+    if df_gantt.empty:
+        return None
+    mapa_de_cores = {'Concluído': '#28B463', 'Em andamento': '#3498DB', 'Á Iniciar': '#F39C12', 'Atrasado': '#E74C3C', 'Cancelado': '#85929E', 'Stand By': '#5D6D7E'}
+    df_gantt = df_gantt.sort_values(by='Data_Inicio')
+    fig = px.timeline(df_gantt, x_start="Data_Inicio", x_end="Data_Termino", y="Atividades_Descricao", color="Status", color_discrete_map=mapa_de_cores, title="Linha do Tempo dos Projetos (Gráfico de Gantt)", hover_data=["Responsavel", "Atividades_Descricao", "Status"])
+    fig.update_yaxes(categoryorder='total ascending')
+    fig.update_traces(hovertemplate="<br>".join(["<b>%{y}</b>", "<b>Status:</b> %{customdata[2]}", "<b>Responsável:</b> %{customdata[0]}", "<b>Início:</b> %{base|%d/%m/%Y}", "<b>Fim:</b> %{x[1]|%d/%m/%Y}", "<extra></extra>"]))
+    return fig
+
+@st.cache_resource(show_spinner=False)
+def get_logo():
+    """Lê o logo uma vez por processo. Os bytes do PNG vão direto para o st.image, sem decodificar e recodificar a cada rerun. None se não existir."""
+    try:
+        with open("Imagem_adm.png", "rb") as arquivo:
+            return arquivo.read()
+    except OSError:
+        return None
+
+@st.cache_resource(show_spinner=False)
+def get_logo_cabecalho(largura=100):
+    """Logo já reduzido para a largura do cabeçalho, para o st.image não redimensionar a imagem a cada rerun."""
+    logo = get_logo()
+    if logo is None:
+        return None
+    try:
+        from PIL import Image
+        imagem = Image.open(io.BytesIO(logo))
+        imagem.thumbnail((largura, imagem.height))
+        saida = io.BytesIO()
+        imagem.save(saida, format="PNG")
+        return saida.getvalue()
+    except OSError:
+        return None
+
+@st.cache_resource
+def get_mongo_client():
+    """Um único MongoClient (e um único pool de conexões) compartilhado por todas as coleções e sessões."""
+    # Pega a string de conexão do secrets.toml
+    connection_string = st.secrets["mongo"]["mongo_uri"]
+    # minPoolSize mantém conexões abertas, então a primeira consulta após o login não paga o handshake TLS
+    # zlib comprime o tráfego de texto (descrições, links) sem dependência extra; só vale se o servidor também anunciar
+    client = MongoClient(connection_string, serverSelectionTimeoutMS=20000, maxPoolSize=20, minPoolSize=2, compressors="zlib")
+    try:
+        client.admin.command("ping")
+    except Exception:
+        # Falha não entra no cache: fecha o cliente para não deixar threads de monitoramento e pool a cada rerun
+        client.close()
+        raise
+    return client
+
+@st.cache_resource
+def _preparar_colecao(collection_name):
+    # Pega o nome do banco de dados do secrets.toml
+    db_name = st.secrets["mongo"]["mongo_db"]
+    colecao = get_mongo_client()[db_name][collection_name]
+
+    # Índices sobre os campos consultados pelo app (create_index não faz nada se o índice já existe)
+    try:
+        colecao.create_index([("ID_Projeto", 1)], unique=True)
+    except OperationFailure as e:
+        # Base com IDs duplicados ou com o índice antigo (não único) em ID_Projeto: mantém o índice existente, mas avisa,
+        # porque sem o índice único o tratamento de DuplicateKeyError no cadastro não protege contra IDs repetidos
+        colecao.create_index([("ID_Projeto", 1)])
+        st.warning(f"O índice único de ID_Projeto não pôde ser criado ({e}). IDs repetidos não serão bloqueados pelo banco; corrija os duplicados na coleção.")
+    colecao.create_index([("ID_Projeto_Seq", -1)])
+    # Preenche ID_Projeto_Seq nos documentos que ainda não têm o campo (registros antigos ou importados), uma vez por processo
+    colecao.update_many({"ID_Projeto": {"$regex": "^PROJ"}, "ID_Projeto_Seq": {"$exists": False}}, [{"$set": {"ID_Projeto_Seq": NUMERO_ID_PROJETO}}])
+    colecao.create_index([("Status", 1), ("Area_Setor", 1)])
+    colecao.create_index([("Responsavel", 1)])
+    colecao.create_index([("Categoria", 1)])
+    return colecao
+
+def get_mongo_collection(collection_name):
+    """Função única para conectar e retornar uma coleção específica."""
+    # Falhas não entram no cache: a próxima execução tenta conectar de novo
+    try:
+        return _preparar_colecao(collection_name)
+    except Exception as e:
+        st.error(f"Erro ao conectar ao MongoDB: {e}")
+        return None
+
 # =======================
 # CONFIGURAÇÃO PÁGINA
 # =======================
@@ -98,9 +295,10 @@ if not st.session_state["login_realizado"]:
     col1, col2, col3 = st.columns([1,1,1])
     with col2:
         st.markdown("<h1 style='text-align: center; color: #002776;'>Sistema de Projetos</h1>", unsafe_allow_html=True)
-        try:
-            st.image(Image.open("Imagem_adm.png"))
-        except:
+        logo = get_logo()
+        if logo is not None:
+            st.image(logo)
+        else:
             st.warning("Imagem 'Imagem_adm.png' não encontrada.")
         
         username = st.text_input("Usuário", key="login_user")
@@ -134,105 +332,131 @@ else:
     # =======================
     col1, col2, col3 = st.columns([1, 6, 2])
     with col1:
-        try: st.image(Image.open("Imagem_adm.png"), width=100)
-        except: pass
+        logo = get_logo_cabecalho()
+        if logo is not None: st.image(logo, width=100)
     with col2: st.markdown("<h1 style='color:#002776; text-align:center;font-size:38px; font-weight:bold;'>Monitoramento de Projetos</h1>", unsafe_allow_html=True)
     with col3: st.markdown(f"**👤 Usuário:** {st.session_state.usuario_logado}")
 
     # =======================
     # CONEXÃO MONGO
     # =======================
-@st.cache_resource
-def get_mongo_collection(collection_name):
-    """Função única para conectar e retornar uma coleção específica."""
-    try:
-        # Pega a string de conexão do secrets.toml
-        connection_string = st.secrets["mongo"]["mongo_uri"]
-        client = MongoClient(connection_string, serverSelectionTimeoutMS=20000)
-        
-        # Pega o nome do banco de dados do secrets.toml
-        db_name = st.secrets["mongo"]["mongo_db"]
-        db = client[db_name]
-        
-        # Retorna a coleção solicitada
-        return db[collection_name]
-
-    except Exception as e:
-        st.error(f"Erro ao conectar ao MongoDB: {e}")
-        return None
-
-# --- Como usar no seu script principal ---
+    projetos_col = get_mongo_collection(st.secrets["mongo"]["mongo_collection_projetos"])
 
-# Pega a coleção de projetos
-projetos_col = get_mongo_collection(st.secrets["mongo"]["mongo_collection_projetos"])
-
-if projetos_col is not None:
-    st.sidebar.success("✅ Conectado")
-    # Agora você já pode usar 'projetos_col' diretamente
-    # Ex: df = pd.DataFrame(list(projetos_col.find()))
-else:
-    st.sidebar.error("❌ Falha na conexão")
-    st.stop()
+    if projetos_col is not None:
+        st.sidebar.success("✅ Conectado")
+    else:
+        st.sidebar.error("❌ Falha na conexão")
+        st.stop()
 
     # =======================
     # CARREGAR DADOS
     # =======================
-    @st.cache_data(ttl=10)
-    def carregar_dados():
-        df = pd.DataFrame(list(projetos_col.find()))
-        if '_id' in df.columns: df.drop(columns=['_id'], inplace=True)
-        if 'Link_dos_Arquivos' not in df.columns: df['Link_dos_Arquivos'] = ""
-        colunas_numericas = ['Budget','Baseline','Melhor_Proposta','Preco_Inicial','Preco_Final','Saving_R$','Percent_Saving','CE_Baseline_R$','Percent_CE_Baseline','CE_R$','Percent_CE','Dias','Progresso_Percent']
-        for col in colunas_numericas:
-            if col in df.columns: 
-                df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
-        colunas_data = ['Data_Inicio','Data_Termino']
-        for col in colunas_data:
-            if col in df.columns: df[col] = pd.to_datetime(df[col], errors='coerce')
-        return df
-    df = carregar_dados()
+    # Versão dos dados: um contador na coleção _meta, incrementado a cada cadastro/atualização. Ela entra na chave
+    # do cache, então qualquer gravação (de qualquer processo) invalida os dados em cache na leitura seguinte.
+    @st.cache_data(ttl=2, show_spinner=False)
+    def versao_dados():
+        doc = projetos_col.database["_meta"].find_one({"_id": projetos_col.name}, {"v": 1})
+        return doc["v"] if doc else 0
+
+    def registrar_alteracao():
+        projetos_col.database["_meta"].update_one({"_id": projetos_col.name}, {"$inc": {"v": 1}}, upsert=True)
+        versao_dados.clear()
+
+    # Uma entrada de cache por combinação de filtros e versão; o TTL longo só cobre alterações feitas fora do app.
+    # Devolve também o instante da carga, que identifica exatamente este DataFrame (ex.: na chave do Excel).
+    @st.cache_data(ttl=600, max_entries=32, show_spinner=False)
+    def carregar_dados(query, projection, versao):
+        # Os filtros vão para o $match e a conversão de tipos para o $project: só os documentos e campos que
+        # interessam saem do MongoDB, com números, datas e o link padrão já resolvidos no servidor.
+        # As colunas já são conhecidas pela projeção, então o DataFrame é montado em um passe só, sem inferir chaves.
+        campos = [campo for campo, incluir in projection.items() if incluir]
+        # batchSize vale para o primeiro lote e para cada getMore: até 1000 projetos chegam em uma única ida ao servidor
+        df = pd.DataFrame(list(projetos_col.aggregate([{"$match": query}, estagio_projecao(projection)], batchSize=1000)), columns=campos)
+        # Os números já chegam como double; aqui só se fixa o dtype (inclusive com o DataFrame vazio)
+        colunas_numericas = [col for col in COLUNAS_NUMERICAS if col in df.columns]
+        if colunas_numericas:
+            df[colunas_numericas] = df[colunas_numericas].astype(float)
+        colunas_data = [col for col in COLUNAS_DATA if col in df.columns]
+        if colunas_data:
+            # Datas em texto que o $convert não entendeu são interpretadas aqui. errors='coerce': texto inválido ou uma
+            # data fora do intervalo do datetime64[ns] (ex.: ano 2999 digitado por engano) vira NaT em vez de derrubar
+            # o carregamento para todos os usuários
+            df[colunas_data] = df[colunas_data].apply(pd.to_datetime, errors='coerce')
+        # Colunas de poucos valores distintos viram 'category': códigos inteiros em vez de strings repetidas
+        colunas_categoricas = [col for col in ['Status','Area_Setor','Responsavel','Categoria','Empresa'] if col in df.columns]
+        if colunas_categoricas:
+            df[colunas_categoricas] = df[colunas_categoricas].astype('category')
+        # Textos livres ficam em memória contígua do Arrow (já instalado com o Streamlit), e não como objetos Python
+        colunas_texto = [col for col in ['ID_Projeto','Id_Contrato','Requisicao','Atividades_Descricao','Link_dos_Arquivos'] if col in df.columns]
+        if colunas_texto:
+            df[colunas_texto] = df[colunas_texto].astype('string[pyarrow]')
+        return df, datetime.now()
+
+    @st.cache_data(ttl=600, max_entries=16, show_spinner=False)
+    def opcoes_filtro(campo, versao):
+        return sorted(v for v in projetos_col.distinct(campo) if v is not None)
+
+    # O formulário de edição usa o documento como está gravado, sem as conversões do carregar_dados: um valor que não
+    # converte (data em outro formato, número em texto) não volta para o banco como 0 ou como a data de hoje.
+    # Cacheado por versão, os reruns do formulário não repetem o find_one.
+    @st.cache_data(ttl=600, max_entries=32, show_spinner=False)
+    def carregar_projeto(id_projeto, versao):
+        return projetos_col.find_one({"ID_Projeto": id_projeto}, PROJECAO_DASHBOARD)
 
     # =======================
     # LISTAS AUXILIARES
     # =======================
-    status_options = ["Á Iniciar","Em andamento","Atrasado","Concluído","Stand By","Cancelado"]
-    empresas_options = ["Postos Gulf","Alpha Matrix","Am Gestao Filz","Am Gestao Mtz","Bcag Sp 0002","Carneiros Go","Carinthia Rj 01","Carinthia Rj 03","Churchill","Clio","Direcional Es","Direcional Fil","Direcional Mt","Direcional Sp","Estrela","Fatro","Fair Energy","Fera Rj","Fera Sp","Fit Marine","Fit Marine Filial","Fit Marine Matriz","Fitfiber","Flagler Go","Flagler Rj","Flagler Sp","Gooil Hub","Gooil","Logfit Filial Aruja","Logfit Filial Caxias","Logfit Filial Rj","Logfit Rj 0002","Logfit Rj 0004","Logfit Sp 0001","Logfit Sp 0006","Logfit Tms Filial","Magro Adv Fil","Magro Adv Matriz","Manguinhos Fil","Manguinhos Filial","Manguinhos Matriz","Manguinhos Mtz","Maximus To","Ornes Gestao","Paradise Td 0001","Petro Go 0006","Petro Rj 0006","Petro Rj 0007","Petro To 0001","Petro To 0004","Port Brazil","Refit Filial Alagoas","Refit Filial Amapa","Refit Matriz","Renomeada 57","Renomeada 61","Renomeada 62","Renomeada 65","Renomeada 66","Roar Fl 0003","Roar Rj 0004","Roar Matriz","Rodopetro Cn","Rodopetro Mtz","Rodopetro Rj Dc","Tiger Matriz","Tig","Uma Cidadania","Valsinha","Vascam","Xyz Sp","Yield Filial","Yield Matriz"]
 
     def gerar_novo_numero():
-        if projetos_col.count_documents({}) == 0: return 1
-        numeros = [int(doc["ID_Projeto"][4:]) for doc in projetos_col.find({},{"ID_Projeto":1}) if str(doc.get("ID_Projeto","")).startswith("PROJ")]
-        return max( numeros ) + 1 if numeros else 1
+        # O maior ID_Projeto_Seq sai do topo do índice, um documento só
+        ultimo = projetos_col.find_one({"ID_Projeto_Seq": {"$type": "number"}}, {"ID_Projeto_Seq": 1, "_id": 0}, sort=[("ID_Projeto_Seq", -1)])
+        maior = ultimo["ID_Projeto_Seq"] if ultimo is not None else 0
+        # Documentos gravados depois do preenchimento por outras ferramentas chegam sem o campo: o sufixo deles também
+        # conta, senão um ID já existente seria gerado de novo. O filtro por null usa o mesmo índice e pega poucos documentos.
+        resultado = list(projetos_col.aggregate([
+            {"$match": {"ID_Projeto_Seq": None, "ID_Projeto": {"$regex": "^PROJ"}}},
+            {"$group": {"_id": None, "maior": {"$max": NUMERO_ID_PROJETO}}}
+        ]))
+        if resultado and resultado[0]["maior"] is not None:
+            maior = max(maior, resultado[0]["maior"])
+        return maior + 1
 
     # =======================
     # MENU LATERAL E FILTROS
     # =======================
     aba = st.sidebar.radio("Escolha uma opção:",["Dashboard","Cadastrar Projeto","Atualizar Projeto"])
 
+    versao = versao_dados()
     with st.sidebar.expander("Filtros", expanded=True):
-        if df.empty:
+        opcoes = {campo: opcoes_filtro(campo, versao) for campo in ["Status", "Area_Setor", "Responsavel", "Categoria"]}
+        if not any(opcoes.values()):
             st.warning("Não há dados para filtrar.")
             status_fil, area_fil, resp_fil, cat_fil, desc_fil = "Todos", "Todos", "Todos", "Todos", ""
         else:
-            status_fil = st.selectbox("Status", ["Todos"] + sorted(df["Status"].dropna().unique()), key="f_status")
-            area_fil = st.selectbox("Área/Setor", ["Todos"] + sorted(df["Area_Setor"].dropna().unique()), key="f_area")
-            resp_fil = st.selectbox("Responsável", ["Todos"] + sorted(df["Responsavel"].dropna().unique()), key="f_resp")
-            cat_fil = st.selectbox("Categoria", ["Todos"] + sorted(df["Categoria"].dropna().unique()), key="f_cat")
+            status_fil = st.selectbox("Status", ["Todos"] + opcoes["Status"], key="f_status")
+            area_fil = st.selectbox("Área/Setor", ["Todos"] + opcoes["Area_Setor"], key="f_area")
+            resp_fil = st.selectbox("Responsável", ["Todos"] + opcoes["Responsavel"], key="f_resp")
+            cat_fil = st.selectbox("Categoria", ["Todos"] + opcoes["Categoria"], key="f_cat")
             desc_fil = st.text_input("Descrição (contém)", key="f_desc")
 
-    def filtrar_df(df):
-        df_f = df.copy()
-        if status_fil != "Todos": df_f = df_f[df_f["Status"]==status_fil]
-        if area_fil != "Todos": df_f = df_f[df_f["Area_Setor"]==area_fil]
-        if resp_fil != "Todos": df_f = df_f[df_f["Responsavel"]==resp_fil]
-        if cat_fil != "Todos": df_f = df_f[df_f["Categoria"]==cat_fil]
-        if desc_fil and "Atividades_Descricao" in df_f.columns: df_f = df_f[df_f["Atividades_Descricao"].str.contains(desc_fil,case=False,na=False)]
-        return df_f
-    df_filtrado = filtrar_df(df)
+    def montar_query_mongo(status_fil, area_fil, resp_fil, cat_fil, desc_fil):
+        query = {}
+        if status_fil != "Todos": query["Status"] = status_fil
+        if area_fil != "Todos": query["Area_Setor"] = area_fil
+        if resp_fil != "Todos": query["Responsavel"] = resp_fil
+        if cat_fil != "Todos": query["Categoria"] = cat_fil
+        if desc_fil: query["Atividades_Descricao"] = {"$regex": re.escape(desc_fil), "$options": "i"}
+        return query
+    query = montar_query_mongo(status_fil, area_fil, resp_fil, cat_fil, desc_fil)
+    df_filtrado, carregado_em = carregar_dados(query, PROJECAO_DASHBOARD, versao)
 
     # =======================
     # ABA DASHBOARD
     # =======================
-    if aba=="Dashboard":
+    # Fragmento: interações dentro do Dashboard (ex.: o botão de download) reexecutam só este bloco,
+    # sem refazer login, conexão e barra lateral
+    @st.fragment
+    def render_dashboard(df_filtrado, chave_dados):
         st.markdown("<h2 style='font-size: 28px; text-align: center;'>📊 Dashboard de Projetos</h2>", unsafe_allow_html=True)
 
         if not df_filtrado.empty and "Status" in df_filtrado.columns:
@@ -241,12 +465,14 @@ else:
             qtd_concluidos = status_counts.get("Concluído", 0)
             qtd_em_andamento = status_counts.get("Em andamento", 0)
             qtd_cancelados = status_counts.get("Cancelado", 0)
-            soma_valor_total = df_filtrado['Preco_Final'].sum() + df_filtrado['Melhor_Proposta'].sum()
-            soma_total_ce = df_filtrado['Saving_R$'].sum() + df_filtrado['CE_R$'].sum() + df_filtrado['CE_Baseline_R$'].sum()
+            # Um único bloco numérico para os dois totais, em vez de cinco somas separadas
+            valores = df_filtrado.reindex(columns=['Preco_Final','Melhor_Proposta','Saving_R$','CE_R$','CE_Baseline_R$'], fill_value=0).to_numpy(dtype=float)
+            soma_valor_total = valores[:, :2].sum()
+            soma_total_ce = valores[:, 2:].sum()
         else:
+            status_counts = pd.Series(dtype=int)
             qtd_total = qtd_concluidos = qtd_em_andamento = qtd_cancelados = soma_valor_total = soma_total_ce = 0
 
-        card_col1, card_col2, card_col3, card_col4, card_col5, card_col6 = st.columns(6)
         cards = [
             ("Qtd Total", qtd_total, "#002776"), 
             ("Cancelados", qtd_cancelados, "#D90429"), 
@@ -256,50 +482,40 @@ else:
             ("Total C.E.", format_valor_kpi(soma_total_ce), "#17a2b8")
         ]
         
-        for col, (titulo, valor, cor) in zip([card_col1, card_col2, card_col3, card_col4, card_col5, card_col6], cards):
-            col.markdown(f'<div style="background-color:{cor};padding:20px;border-radius:15px;text-align:center;height:120px;display:flex;flex-direction:column;justify-content:center;"><h3 style="color:white;margin:0 0 8px 0;font-size:16px;">{titulo}</h3><h2 style="color:white;margin:0;font-size:20px;font-weight:bold;">{valor}</h2></div>', unsafe_allow_html=True)
+        # Os seis cards vão em um único bloco HTML: uma mensagem para o navegador em vez de seis
+        cards_html = "".join(f'<div style="flex:1;min-width:160px;background-color:{cor};padding:20px;border-radius:15px;text-align:center;height:120px;display:flex;flex-direction:column;justify-content:center;"><h3 style="color:white;margin:0 0 8px 0;font-size:16px;">{titulo}</h3><h2 style="color:white;margin:0;font-size:20px;font-weight:bold;">{valor}</h2></div>' for titulo, valor, cor in cards)
+        st.markdown(f'<div style="display:flex;flex-wrap:wrap;gap:1rem;">{cards_html}</div>', unsafe_allow_html=True)
 
         st.markdown("<hr>", unsafe_allow_html=True)
 
         if not df_filtrado.empty:
-            paleta = ['#F2C94C', '#2B9348', '#3596B5', '#9BAEBC', '#E74C3C', '#5D6D7E']
-            
-            if 'Status' in df_filtrado and not df_filtrado['Status'].empty:
-                status_counts = df_filtrado['Status'].value_counts().reset_index()
-                status_counts.columns = ['Status', 'Quantidade']
-                fig_status = px.bar(status_counts, x='Status', y='Quantidade', color='Status', color_discrete_sequence=paleta, text_auto=True, title='Quantidade de Projetos por Status')
-                fig_status.update_traces(textposition='outside')
-                max_val = status_counts['Quantidade'].max()
-                fig_status.update_yaxes(tickmode='linear', dtick=1, range=[0, max_val * 1.15])
-                st.plotly_chart(fig_status, use_container_width=True)
+            # Reaproveita a contagem por status já feita para os cards
+            if not status_counts.empty:
+                st.plotly_chart(montar_grafico_status(status_counts.rename_axis('Status').reset_index(name='Quantidade')), use_container_width=True)
 
             if 'Responsavel' in df_filtrado and not df_filtrado['Responsavel'].dropna().empty:
-                resp_counts = df_filtrado['Responsavel'].value_counts().reset_index()
-                resp_counts.columns = ['Responsavel', 'Quantidade']
-                fig_resp = px.bar(resp_counts, x='Responsavel', y='Quantidade', color='Quantidade', color_continuous_scale='Blues', text_auto=True, title='Quantidade de Projetos por Responsável')
-                fig_resp.update_traces(textposition='outside')
-                max_val = resp_counts['Quantidade'].max()
-                fig_resp.update_yaxes(tickmode='linear', dtick=1, range=[0, max_val * 1.15])
-                st.plotly_chart(fig_resp, use_container_width=True)
+                resp_counts = df_filtrado['Responsavel'].value_counts().rename_axis('Responsavel').reset_index(name='Quantidade')
+                st.plotly_chart(montar_grafico_responsavel(resp_counts), use_container_width=True)
 
         st.markdown("<hr>", unsafe_allow_html=True)
-        df_gantt = df_filtrado.dropna(subset=['Data_Inicio', 'Data_Termino']).copy()
+        fig = montar_grafico_gantt(df_filtrado[["Data_Inicio", "Data_Termino", "Atividades_Descricao", "Status", "Responsavel"]])
         
-        if df_gantt.empty:
+        if fig is None:
             st.info("Nenhum projeto com datas de início e término para exibir no cronograma.")
         else:
-            mapa_de_cores = {'Concluído': '#28B463', 'Em andamento': '#3498DB', 'Á Iniciar': '#F39C12', 'Atrasado': '#E74C3C', 'Cancelado': '#85929E', 'Stand By': '#5D6D7E'}
-            df_gantt = df_gantt.sort_values(by='Data_Inicio')
-            fig = px.timeline(df_gantt, x_start="Data_Inicio", x_end="Data_Termino", y="Atividades_Descricao", color="Status", color_discrete_map=mapa_de_cores, title="Linha do Tempo dos Projetos (Gráfico de Gantt)", hover_data=["Responsavel", "Atividades_Descricao", "Status"])
-            fig.update_yaxes(categoryorder='total ascending')
+            # A linha de "Hoje" fica fora do cache para acompanhar a data atual
             fig.add_vline(x=pd.Timestamp.now(), line_width=2, line_dash="dash", line_color="grey", annotation_text="Hoje")
-            fig.update_traces(hovertemplate="<br>".join(["<b>%{y}</b>", "<b>Status:</b> %{customdata[2]}", "<b>Responsável:</b> %{customdata[0]}", "<b>Início:</b> %{base|%d/%m/%Y}", "<b>Fim:</b> %{x[1]|%d/%m/%Y}", "<extra></extra>"]))
             st.plotly_chart(fig, use_container_width=True)
             
         st.subheader("Tabela de Dados")
-        st.dataframe(df_filtrado, use_container_width=True, hide_index=True, column_config={"Link_dos_Arquivos": st.column_config.LinkColumn("Link dos Arquivos", display_text="Abrir ↗")})
-        st.download_button("📥 Download Excel", convert_df_to_excel(df_filtrado),"dashboard_projetos.xlsx","application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+        # Datas formatadas pelo próprio st.dataframe no navegador: nenhuma coluna de texto é gerada no Python a cada rerun
+        config_colunas = {"Link_dos_Arquivos": st.column_config.LinkColumn("Link dos Arquivos", display_text="Abrir ↗"), "Data_Inicio": st.column_config.DateColumn("Data_Inicio", format="DD/MM/YYYY"), "Data_Termino": st.column_config.DateColumn("Data_Termino", format="DD/MM/YYYY")}
+        st.dataframe(df_filtrado, use_container_width=True, hide_index=True, column_config=config_colunas)
+        st.download_button("📥 Download Excel", convert_df_to_excel(chave_dados, df_filtrado),"dashboard_projetos.xlsx","application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
         
+    if aba=="Dashboard":
+        render_dashboard(df_filtrado, (query, versao, carregado_em))
+
     # =======================
     # CADASTRAR PROJETO
     # =======================
@@ -318,11 +534,11 @@ else:
             requisicao = col2.text_input("Requisição")
             area_setor = st.text_input("Área/Setor")
             categoria = st.text_input("Categoria")
-            empresa = st.selectbox("Empresa", ["Selecione"] + empresas_options)
+            empresa = st.selectbox("Empresa", ["Selecione", *EMPRESAS_OPTIONS])
             responsavel = st.text_input("Responsável")
             descricao = st.text_area("Atividades_Descricao")
             link_arquivos = st.text_input("Link dos Arquivos", placeholder="Cole o link da pasta aqui")
-            status = st.selectbox("Status", ["Selecione"] + status_options)
+            status = st.selectbox("Status", ["Selecione", *STATUS_OPTIONS])
             
             if tem_budget or tem_baseline:
                 st.markdown("### Orçamento (Budget/Baseline)")
@@ -350,9 +566,14 @@ else:
             data_termino = st.date_input("Data de Término", value=datetime.today(), format="DD/MM/YYYY")
             submitted = st.form_submit_button("Salvar Projeto")
             if submitted:
-                projeto_dict = {"ID_Projeto": novo_id, "Id_Contrato": id_contrato, "Requisicao": requisicao, "Area_Setor": area_setor, "Categoria": categoria, "Empresa": empresa, "Responsavel": responsavel, "Atividades_Descricao": descricao, "Link_dos_Arquivos": link_arquivos, "Status": status, "Tem_Budget": tem_budget, "Tem_Baseline": tem_baseline, "Budget": budget, "Baseline": baseline, "Melhor_Proposta": melhor_proposta, "Preco_Inicial": preco_inicial, "Preco_Final": preco_final, "Data_Inicio": pd.to_datetime(data_inicio), "Data_Termino": pd.to_datetime(data_termino)}
+                projeto_dict = {"ID_Projeto": novo_id, "ID_Projeto_Seq": int(novo_id[4:]), "Id_Contrato": id_contrato, "Requisicao": requisicao, "Area_Setor": area_setor, "Categoria": categoria, "Empresa": empresa, "Responsavel": responsavel, "Atividades_Descricao": descricao, "Link_dos_Arquivos": link_arquivos, "Status": status, "Tem_Budget": tem_budget, "Tem_Baseline": tem_baseline, "Budget": budget, "Baseline": baseline, "Melhor_Proposta": melhor_proposta, "Preco_Inicial": preco_inicial, "Preco_Final": preco_final, "Data_Inicio": pd.to_datetime(data_inicio), "Data_Termino": pd.to_datetime(data_termino)}
                 projeto_dict.update(resultados_kpis)
-                projetos_col.insert_one(projeto_dict)
+                try:
+                    projetos_col.insert_one(projeto_dict)
+                except DuplicateKeyError:
+                    st.error(f"O ID {novo_id} acabou de ser usado por outro cadastro. Tente salvar novamente.")
+                    st.stop()
+                registrar_alteracao()
                 st.success(f"Projeto {novo_id} cadastrado com sucesso!")
                 st.rerun()
 
@@ -361,10 +582,12 @@ else:
     # =======================
     elif aba=="Atualizar Projeto":
         st.header("Atualizar Projeto Existente")
+        # Mesma entrada de cache do Dashboard sem filtros: a lista de IDs não gera outra consulta ao MongoDB
+        df, _ = carregar_dados({}, PROJECAO_DASHBOARD, versao)
         lista_projetos = [""] + df["ID_Projeto"].tolist() if not df.empty else [""]
         id_selecionado = st.selectbox("Selecione o Projeto", lista_projetos)
         if id_selecionado:
-            projeto = projetos_col.find_one({"ID_Projeto": id_selecionado})
+            projeto = carregar_projeto(id_selecionado, versao)
             if projeto:
                 st.markdown("---")
                 st.markdown("##### Opções de Orçamento")
@@ -379,13 +602,13 @@ else:
                     requisicao = col2.text_input("Requisição", value=projeto.get("Requisicao", ""))
                     area_setor = st.text_input("Área/Setor", value=projeto.get("Area_Setor", ""))
                     categoria = st.text_input("Categoria", value=projeto.get("Categoria", ""))
-                    empresa_idx = empresas_options.index(projeto.get("Empresa", "")) if projeto.get("Empresa") in empresas_options else 0
-                    empresa = st.selectbox("Empresa", empresas_options, index=empresa_idx)
+                    empresa_idx = EMPRESAS_INDEX.get(projeto.get("Empresa", ""), 0)
+                    empresa = st.selectbox("Empresa", EMPRESAS_OPTIONS, index=empresa_idx)
                     responsavel = st.text_input("Responsável", value=projeto.get("Responsavel", ""))
                     descricao = st.text_area("Atividades_Descricao", value=projeto.get("Atividades_Descricao", ""))
                     link_arquivos = st.text_input("Link dos Arquivos", value=projeto.get("Link_dos_Arquivos", ""))
-                    status_idx = status_options.index(projeto.get("Status", "")) if projeto.get("Status") in status_options else 0
-                    status = st.selectbox("Status", status_options, index=status_idx)
+                    status_idx = STATUS_INDEX.get(projeto.get("Status", ""), 0)
+                    status = st.selectbox("Status", STATUS_OPTIONS, index=status_idx)
                     st.markdown("---")
                     st.markdown("#### Cronograma")
                     c_data1, c_data2 = st.columns(2)
@@ -417,7 +640,12 @@ else:
                     if submitted:
                         update_data = {"Id_Contrato": id_contrato, "Requisicao": requisicao, "Area_Setor": area_setor, "Categoria": categoria, "Empresa": empresa, "Responsavel": responsavel, "Atividades_Descricao": descricao, "Link_dos_Arquivos": link_arquivos, "Status": status, "Tem_Budget": tem_budget_upd, "Tem_Baseline": tem_baseline_upd, "Budget": budget, "Baseline": baseline, "Melhor_Proposta": melhor_proposta, "Preco_Inicial": preco_inicial, "Preco_Final": preco_final, "Data_Inicio": pd.to_datetime(data_inicio), "Data_Termino": pd.to_datetime(data_termino)}
                         update_data.update(resultados_kpis_upd)
-                        projetos_col.update_one({"ID_Projeto": id_selecionado}, {"$set": update_data})
+                        # Uma única ida ao banco: o formulário veio do cache e o próprio update informa se o projeto ainda existe
+                        resultado = projetos_col.update_one({"ID_Projeto": id_selecionado}, {"$set": update_data})
+                        if resultado.matched_count == 0:
+                            st.error(f"Projeto {id_selecionado} não foi encontrado no banco. Atualize a página e tente novamente.")
+                            st.stop()
+                        registrar_alteracao()
                         st.success(f"Projeto {id_selecionado} atualizado com sucesso!")
                         st.rerun()
 